@@ -1,13 +1,33 @@
 # main.py
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-import requests
-from bs4 import BeautifulSoup
+from fastapi import FastAPI, HTTPException, Response
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from cssselect import SelectorError
+from functools import lru_cache
+import httpx
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+import math
+import orjson
+import os
 import re
-from typing import Dict, Any
+import redis.asyncio as aioredis
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import time
 
-app = FastAPI(title="MeteoXabia API", version="1.0")
+# -------------------------
+# selectores CSS de la plantilla wx9 (ids de los datos ajax de Weather Display): si todos
+# encuentran su elemento no hace falta recorrer la página entera con parse_wx9
+SELECTORS_WX9 = {
+    "temperature": "#ajaxtemp",
+    "humidity": "#ajaxhumidity",
+    "wind_speed_kmh": "#ajaxwind",
+    "rain_mm": "#ajaxrain",
+    "day_temp_max": "#ajaxtempmax",
+    "day_temp_min": "#ajaxtempmin",
+    "day_wind_max": "#ajaxwindmaxgust",
+}
 
 # -------------------------
 # CONFIG: estaciones iniciales
@@ -23,297 +43,594 @@ ESTACIONES = {
         "id": "lluca",
         "nombre": "Xàbia - Lluca/Rafalet",
         "url": "https://www.meteoxabia.com/estacions/lluca/wx9.html",
-        "tipo": "wx9"
+        "tipo": "wx9",
+        "selectors": SELECTORS_WX9
     },
     "faro": {
         "id": "faro",
         "nombre": "Xàbia - Faro Cabo de la Nao",
         "url": "https://www.meteoxabia.com/estacions/farolanao/wx9.html",
-        "tipo": "wx9"
+        "tipo": "wx9",
+        "selectors": SELECTORS_WX9
     },
 }
 
 # -------------------------
-# CACHE simple en memoria para no hacer scrapes cada petición
+# CACHE simple en memoria, refrescado en segundo plano cada CACHE_TTL
 CACHE: Dict[str, Dict[str, Any]] = {}
 CACHE_TTL = 120  # segundos (ajusta según quieras; Render free: no abusar)
 
+# CACHE compartido opcional en Redis (REDIS_URL): con varios workers todos ven los mismos
+# datos, solo uno descarga cada página y sobrevive a reinicios. CACHE sigue siendo la copia
+# local y el fallback si Redis no está configurado o falla
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS: Optional[aioredis.Redis] = None
+REDIS_KEEP = 24 * 3600  # segundos que Redis guarda el último dato (para servirlo como stale)
+# segundos; cache_get va en cada petición: si Redis no contesta mejor caer enseguida a la
+# cache local que dejar colgadas todas las peticiones
+REDIS_TIMEOUT = 0.5
+FETCH_LOCK_TTL = 15  # segundos; más que el timeout de descarga + parseo
+
 # -------------------------
 # helpers de parsing
+# RE2 (google-re2) solo si se pide con USE_RE2=1: garantiza tiempo lineal pase lo que
+# pase en la página, pero con las páginas normales de las estaciones es 2-3 veces más
+# lento que re (~155 frente a 40-60 µs); solo compensa con páginas enormes o raras
+if os.environ.get("USE_RE2") == "1":
+    import re2
+else:
+    re2 = None
+
+def rx(pattern: str, flags: int = 0):
+    """Compila con RE2 si USE_RE2=1, si no con re. Ojo: en RE2 \\d y \\s son solo ASCII"""
+    if re2 is None:
+        return re.compile(pattern, flags)
+    # re2 no acepta los flags de re: re.I va como (?i) dentro del patrón
+    return re2.compile(("(?i)" if flags & re.I else "") + pattern)
+
+# extract_number lo usa con cadenas cortas, donde el coste de llamar a RE2 domina: siempre re
 re_num = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+# patrones precompilados: uno por campo, con el valor en el grupo "v" y la unidad
+# (si la hay) en "u". Cada patrón se busca por separado: re.search se para en la
+# primera aparición y aprovecha el prefijo literal, mucho más rápido que una sola
+# alternación recorrida entera con finditer
+NUM = r"[-+]?\d+(?:[\.,]\d+)?"
+# cualquier número con °C (fallback de temperatura, y principal en wx9)
+re_temp_any = rx(rf"(?P<v>{NUM})\s*°\s*C")
+# avamet
+re_avamet_fields = [
+    ("temperature", rx(rf"(?:[Tt]emp(?:erature)?|Temperatura|Temperatura:)[:\s]*(?P<v>{NUM})\s*°?C")),
+    ("humidity", rx(rf"(?:Hum|Humedad|Humidity)[:\s]*(?P<v>{NUM})\s*%?", re.I)),
+    ("wind_speed_kmh", rx(rf"(?:Wind|Viento|Velocidad del viento)[:\s]*(?P<v>{NUM})\s*(?P<u>km/h|kph|m/s)?", re.I)),
+    ("rain_mm", rx(rf"(?:Rain|Lluvia).{{0,15}}?(?P<v>{NUM})\s*(?:mm|l|litros)?", re.I)),
+    ("day_temp_max", rx(rf"(?:Max(?:imum)? Temp(?:erature)?|Máx(?:ima)? temperatura|Temperatura máxima)[^\d\-+]*?(?P<v>{NUM})", re.I)),
+    ("day_temp_min", rx(rf"(?:Min(?:imum)? Temp(?:erature)?|Mín(?:ima)? temperatura|Temperatura mínima)[^\d\-+]*?(?P<v>{NUM})", re.I)),
+    ("month_rain_mm", rx(rf"(?:Month|Mes).{{0,15}}?(?P<v>{NUM})\s*(?:mm|l)?", re.I)),
+    ("year_rain_mm", rx(rf"(?:Year|Año).{{0,15}}?(?P<v>{NUM})\s*(?:mm|l)?", re.I)),
+]
+# wx9
+re_wx9_fields = [
+    ("temperature", re_temp_any),
+    ("humidity", rx(rf"Humidity[:\s]*(?P<v>{NUM})\s*%", re.I)),
+    ("wind_speed_kmh", rx(rf"Wind(?: Speed)?[:\s]*(?P<v>{NUM})\s*(?P<u>km/h|kph|mph|m/s)?", re.I)),
+    ("rain_mm", rx(rf"(?:Rain|Precipitation|Precipitación|Lluvia).{{0,20}}?(?P<v>{NUM})\s*(?:mm|l)?", re.I)),
+    ("day_temp_max", rx(rf"Max(?:imum)? Temp(?:erature)?[^\d\-+]*?(?P<v>{NUM})", re.I)),
+    ("day_temp_min", rx(rf"Min(?:imum)? Temp(?:erature)?[^\d\-+]*?(?P<v>{NUM})", re.I)),
+    ("day_wind_max", rx(rf"Max Wind[^\d\-+]*?(?P<v>{NUM})", re.I)),
+]
+# pares "Etiqueta: valor" (fallback); tras la palabra clave puede haber más texto
+# ("Wind Speed: 10") pero sin números ni separadores, para no leer "14:02" como valor.
+# Se busca sobre el texto ya en minúsculas: sin re.I, re salta directamente a las
+# posiciones que empiezan por la inicial de alguna palabra clave
+re_label = rx(rf"(?P<k>humidity|humedad|hum|temp|wind|viento|rain|lluvia|precip)[^:|\d]{{0,30}}:\s*(?P<v>{NUM})")
+# raíz capturada en k -> campo; las raíces que no están no cuentan para ese parser
+avamet_labels = {
+    "humidity": "humidity", "humedad": "humidity", "hum": "humidity",
+    "temp": "temperature",
+    "wind": "wind_speed_kmh", "viento": "wind_speed_kmh",
+    "rain": "rain_mm", "lluvia": "rain_mm",
+}
+# en wx9 solo la palabra entera: "Humidex" (sensación térmica) no es la humedad
+wx9_labels = {
+    "humidity": "humidity", "humedad": "humidity",
+    "temp": "temperature",
+    "wind": "wind_speed_kmh", "viento": "wind_speed_kmh",
+    "rain": "rain_mm", "lluvia": "rain_mm", "precip": "rain_mm",
+}
+
+def to_float(s: str) -> Optional[float]:
+    """Número con coma o punto decimal; None si no es un float finito (no se puede servir en JSON)"""
+    if not s:
+        return None
+    try:
+        val = float(s.replace(",", "."))
+    except ValueError:
+        return None
+    return val if math.isfinite(val) else None
+
 def extract_number(s: str):
     """Devuelve primer número como float o None"""
     if not s:
         return None
     m = re_num.search(s.replace(",", "."))
-    return float(m.group()) if m else None
+    return to_float(m.group()) if m else None
 
-def text_normalize(t: str):
-    return t.strip().replace("\xa0", " ")
+def parse_html(content: bytes) -> lxml.html.HtmlElement:
+    """Árbol lxml de la página; sin BeautifulSoup, todo el parseo se queda en C"""
+    try:
+        try:
+            # sin <meta charset> lxml asume latin-1 y rompe el "°"; probamos antes utf-8
+            tree = lxml.html.fromstring(content.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            # otra codificación o <?xml encoding?>: que la detecte lxml
+            tree = lxml.html.fromstring(content)
+    except etree.ParserError:
+        # página vacía
+        return lxml.html.fromstring("<html></html>")
+    # como get_text de BeautifulSoup, no contamos el contenido de script/style
+    for el in tree.iter("script", "style"):
+        el.text = None
+    return tree
 
-# parser genérico para avamet.htm (intenta encontrar pares "Label: value")
-def parse_avamet(soup: BeautifulSoup) -> Dict[str, Any]:
+TEXT_TAGS = ("span", "td", "p", "div", "li")
+_TEXT_TAGS = frozenset(TEXT_TAGS)
+
+def find_text_tags(tree: lxml.html.HtmlElement) -> List[lxml.html.HtmlElement]:
+    """Los span/td/p/div/li más externos, en orden de documento.
+
+    El texto de los anidados ya está dentro del de su contenedor, y repetirlo
+    multiplicaba el tamaño de combined por la profundidad. Un solo recorrido que no
+    entra en los elementos encontrados, sin mirar los ancestros de cada nodo.
+    """
+    found = []
+    stack = [tree]
+    while stack:
+        el = stack.pop()
+        if el.tag in _TEXT_TAGS:
+            found.append(el)
+        else:
+            # al revés para sacarlos de la pila en orden de documento
+            stack.extend(reversed(el))
+    return found
+
+def tag_texts(tree: lxml.html.HtmlElement) -> List[str]:
+    """Texto de cada span/td/p/div/li externo, con los trozos unidos por espacios (como get_text(" ", strip=True))"""
+    items = []
+    for el in find_text_tags(tree):
+        # split() sin argumentos también corta por \xa0
+        txt = " ".join(" ".join(el.itertext()).split())
+        if txt:
+            items.append(txt)
+    return items
+
+def wind_to_kmh(val: float, unit: str) -> float:
+    unit = (unit or "").lower()
+    if "mph" in unit:
+        val = val * 1.60934
+    if "m/s" in unit:
+        val = val * 3.6
+    return round(val, 2)
+
+def scan_fields(fields, combined: str) -> Dict[str, Any]:
+    """Primera aparición de cada campo de la tabla (key, patrón) en combined"""
     res = {}
-    text_items = []
+    for key, pattern in fields:
+        m = pattern.search(combined)
+        if not m:
+            continue
+        val = to_float(m.group("v"))
+        if val is None:
+            continue
+        if key == "wind_speed_kmh":
+            val = wind_to_kmh(val, m.group("u") or "km/h")
+        res[key] = val
+    return res
+
+def scan_labels(labels, combined: str, res: Dict[str, Any]) -> Dict[str, Any]:
+    """Completa res con los pares etiqueta:valor; la humedad de la etiqueta manda, el resto solo rellena"""
+    for m in re_label.finditer(combined.lower()):
+        key = labels.get(m.group("k"))
+        if key is None:
+            continue
+        val = to_float(m.group("v"))
+        if val is not None and (key == "humidity" or key not in res):
+            res[key] = val
+    return res
+
+# parser genérico para avamet.htm (intenta encontrar pares "Label: value")
+def parse_avamet(tree: lxml.html.HtmlElement) -> Dict[str, Any]:
     # extraemos spans, td y p
-    for tag in soup.find_all(["span", "td", "p", "div", "li"]):
-        txt = text_normalize(tag.get_text(separator=" ", strip=True))
-        if txt:
-            text_items.append(txt)
+    text_items = tag_texts(tree)
     # Buscamos por patrones comunes
     combined = " | ".join(text_items)
-    # temperatura
-    m = re.search(r"([Tt]emp(?:erature)?|Temperatura|Temperatura:)[:\s]*([-+]?\d+(?:[\.,]\d+)?)\s*°?C", combined)
-    if m:
-        res["temperature"] = float(m.group(2).replace(",", "."))
-    else:
+    res = scan_fields(re_avamet_fields, combined)
+    if "temperature" not in res:
         # fallback: buscar cualquier número con °C
-        m2 = re.search(r"([-+]?\d+(?:[\.,]\d+)?)\s*°\s*C|([-+]?\d+(?:[\.,]\d+)?)\s*°C", combined)
-        if m2:
-            val = m2.group(1) or m2.group(2)
-            res["temperature"] = float(val.replace(",", "."))
-    # humedad
-    m = re.search(r"(Hum|Humedad|Humidity)[:\s]*([-+]?\d+(?:[\.,]\d+)?)\s*%?", combined, re.I)
-    if m:
-        res["humidity"] = float(m.group(2).replace(",", "."))
-    # viento: busco "Wind", "Viento" y velocidad (km/h or m/s)
-    m = re.search(r"(Wind|Viento|Velocidad del viento)[:\s]*([-+]?\d+(?:[\.,]\d+)?)\s*(km/h|kph|m/s)?", combined, re.I)
-    if m:
-        val = float(m.group(2).replace(",", "."))
-        unit = m.group(3) or "km/h"
-        # si m/s convertir a km/h
-        if unit and "m/s" in unit:
-            val = val * 3.6
-        res["wind_speed_kmh"] = round(val, 2)
-    # lluvia: buscar 'Rain', 'Lluvia'
-    m = re.search(r"(Rain|Lluvia).{0,15}?([-+]?\d+(?:[\.,]\d+)?)\s*(mm|l|litros)?", combined, re.I)
-    if m:
-        res["rain_mm"] = float(m.group(2).replace(",", "."))
-    # max/min del día (search labels like Max Temp today / Min Temp)
-    mmax = re.search(r"(Max(?:imum)? Temp(?:erature)?|Máx(?:ima)? temperatura|Temperatura máxima)[^\d\-+]*?([-+]?\d+(?:[\.,]\d+)?)", combined, re.I)
-    mmin = re.search(r"(Min(?:imum)? Temp(?:erature)?|Mín(?:ima)? temperatura|Temperatura mínima)[^\d\-+]*?([-+]?\d+(?:[\.,]\d+)?)", combined, re.I)
-    if mmax:
-        res["day_temp_max"] = float(mmax.group(2).replace(",", "."))
-    if mmin:
-        res["day_temp_min"] = float(mmin.group(2).replace(",", "."))
-    # monthly / yearly rainfall; busca 'Month' o 'Year'
-    mmonth = re.search(r"(Month|Mes).{0,15}?([-+]?\d+(?:[\.,]\d+)?)\s*(mm|l)?", combined, re.I)
-    myear = re.search(r"(Year|Año).{0,15}?([-+]?\d+(?:[\.,]\d+)?)\s*(mm|l)?", combined, re.I)
-    if mmonth:
-        res["month_rain_mm"] = float(mmonth.group(2).replace(",", "."))
-    if myear:
-        res["year_rain_mm"] = float(myear.group(2).replace(",", "."))
-    # Si falta, intentamos extraer por pares label:value
-    # buscaremos palabras clave
-    keywords = {
-        "pressure": ["presion", "pressure"],
-        "wind_dir": ["dir", "direccion", "wind direction"],
-        "rain_today": ["rain today", "lluvia hoy"],
-    }
+        m = re_temp_any.search(combined)
+        val = to_float(m.group("v")) if m else None
+        if val is not None:
+            res["temperature"] = val
     # scanning for label: value patterns
-    for t in text_items:
-        if ":" in t:
-            left, right = [x.strip() for x in t.split(":", 1)]
-            low = left.lower()
-            if any(k in low for k in ["hum", "humedad", "humidity"]):
-                v = extract_number(right)
-                if v is not None:
-                    res["humidity"] = v
-            if any(k in low for k in ["temp", "temperatura"]):
-                v = extract_number(right)
-                if v is not None and "temperature" not in res:
-                    res["temperature"] = v
-            if any(k in low for k in ["wind", "viento"]):
-                v = extract_number(right)
-                if v is not None and "wind_speed_kmh" not in res:
-                    res["wind_speed_kmh"] = v
-            if any(k in low for k in ["rain", "lluvia"]):
-                v = extract_number(right)
-                if v is not None and "rain_mm" not in res:
-                    res["rain_mm"] = v
+    scan_labels(avamet_labels, combined, res)
     return res
 
 # parser para wx9.html (Cumulus / Weather Display alike)
-def parse_wx9(soup: BeautifulSoup) -> Dict[str, Any]:
-    res = {}
+def parse_wx9(tree: lxml.html.HtmlElement) -> Dict[str, Any]:
     # muchas plantillas wx9 muestran tablas con labels en <td>
-    text_items = []
-    for td in soup.find_all(["td", "span", "div", "p", "li"]):
-        txt = text_normalize(td.get_text(" ", strip=True))
-        if txt:
-            text_items.append(txt)
+    text_items = tag_texts(tree)
     combined = " | ".join(text_items)
-    # temperatura: buscar números con °C
-    m = re.search(r"([-+]?\d+(?:[\.,]\d+)?)\s*°\s*C|([-+]?\d+(?:[\.,]\d+)?)\s*°C", combined)
-    if m:
-        val = m.group(1) or m.group(2)
-        res["temperature"] = float(val.replace(",", "."))
-    # humedad %
-    m = re.search(r"Humidity[:\s]*([-+]?\d+(?:[\.,]\d+)?)\s*%", combined, re.I)
-    if m:
-        res["humidity"] = float(m.group(1).replace(",", "."))
-    # wind
-    m = re.search(r"Wind(?: Speed)?[:\s]*([-+]?\d+(?:[\.,]\d+)?)\s*(km/h|kph|mph|m/s)?", combined, re.I)
-    if m:
-        val = float(m.group(1).replace(",", "."))
-        unit = (m.group(2) or "").lower()
-        if "mph" in unit:
-            val = val * 1.60934
-        if "m/s" in unit:
-            val = val * 3.6
-        res["wind_speed_kmh"] = round(val, 2)
-    # precipitation / rain
-    m = re.search(r"(Rain|Precipitation|Precipitación|Lluvia).{0,20}?([-+]?\d+(?:[\.,]\d+)?)\s*(mm|l)?", combined, re.I)
-    if m:
-        res["rain_mm"] = float(m.group(2).replace(",", "."))
-    # maxima/minima day/month/year (buscamos palabras clave)
-    for pattern, key in [
-        (r"Max(?:imum)? Temp(?:erature)?[^\d\-+]*?([-+]?\d+(?:[\.,]\d+)?)", "day_temp_max"),
-        (r"Min(?:imum)? Temp(?:erature)?[^\d\-+]*?([-+]?\d+(?:[\.,]\d+)?)", "day_temp_min"),
-        (r"Max Wind[^\d\-+]*?([-+]?\d+(?:[\.,]\d+)?)", "day_wind_max"),
-    ]:
-        m = re.search(pattern, combined, re.I)
-        if m:
-            res[key] = float(m.group(1).replace(",", "."))
+    res = scan_fields(re_wx9_fields, combined)
     # fallback: key:value pairs
-    for t in text_items:
-        if ":" in t:
-            left, right = [x.strip() for x in t.split(":", 1)]
-            low = left.lower()
-            if "humidity" in low or "humedad" in low:
-                v = extract_number(right)
-                if v is not None:
-                    res["humidity"] = v
-            if any(w in low for w in ["temp", "temperatura"]):
-                v = extract_number(right)
-                if v is not None and "temperature" not in res:
-                    res["temperature"] = v
-            if any(w in low for w in ["wind", "viento"]):
-                v = extract_number(right)
-                if v is not None and "wind_speed_kmh" not in res:
-                    res["wind_speed_kmh"] = v
-            if any(w in low for w in ["rain", "lluvia", "precip"]):
-                v = extract_number(right)
-                if v is not None and "rain_mm" not in res:
-                    res["rain_mm"] = v
+    scan_labels(wx9_labels, combined, res)
+    return res
+
+# parser directo para estaciones con "selectors" (campo -> selector CSS)
+# acotada: /api/estacion/add acepta CSS arbitrario
+@lru_cache(maxsize=256)
+def compile_selector(css: str) -> CSSSelector:
+    # el CSS se traduce a XPath una sola vez por selector
+    # traductor html: etiquetas sin distinguir mayúsculas y pseudo-clases como :checked
+    return CSSSelector(css, translator="html")
+
+def parse_specialized(tree: lxml.html.HtmlElement, selectors: Dict[str, str]) -> Dict[str, Any]:
+    """Lee cada campo de su elemento; solo devuelve los que encuentra"""
+    res = {}
+    for key, css in selectors.items():
+        els = compile_selector(css)(tree)
+        if not els:
+            continue
+        txt = " ".join(" ".join(els[0].itertext()).split())
+        val = extract_number(txt)
+        if val is None:
+            continue
+        if key == "wind_speed_kmh":
+            val = wind_to_kmh(val, txt)
+        res[key] = val
     return res
 
+# campos que puede sacar el parser genérico de cada tipo: solo se lo salta una estación
+# cuyos selectores los han encontrado todos
+GENERIC_FIELDS = {
+    "avamet": frozenset(k for k, _ in re_avamet_fields) | frozenset(avamet_labels.values()),
+    "wx9": frozenset(k for k, _ in re_wx9_fields) | frozenset(wx9_labels.values()),
+}
+
 # -------------------------
 # función para obtener datos normalizados
-def scrape_station(station: Dict[str, Any]) -> Dict[str, Any]:
-    now = time.time()
-    sid = station["id"]
-    # cache check
-    cached = CACHE.get(sid)
-    if cached and now - cached["ts"] < CACHE_TTL:
-        return cached["data"]
-    url = station["url"]
-    try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-    except Exception as e:
-        data = {"error": f"fetch_error: {str(e)}", "url": url}
-        CACHE[sid] = {"ts": now, "data": data}
-        return data
-    soup = BeautifulSoup(r.content, "html.parser")
+def build_station_data(station: Dict[str, Any], content: bytes, now: float) -> Dict[str, Any]:
+    tree = parse_html(content)
+    selectors = station.get("selectors")
+    parsed = parse_specialized(tree, selectors) if selectors else {}
     tipo = station.get("tipo", "avamet")
-    if tipo == "avamet":
-        parsed = parse_avamet(soup)
-    else:
-        parsed = parse_wx9(soup)
+    if not GENERIC_FIELDS["avamet" if tipo == "avamet" else "wx9"] <= parsed.keys():
+        # falta algún campo: parser genérico, y lo leído directamente manda
+        if tipo == "avamet":
+            generic = parse_avamet(tree)
+        else:
+            generic = parse_wx9(tree)
+        parsed = {**generic, **parsed}
     # normalizar salida
-    out = {
-        "id": sid,
+    return {
+        "id": station["id"],
         "nombre": station.get("nombre"),
-        "url": url,
+        "url": station["url"],
         "fetched_at": int(now),
         "datos": parsed
     }
-    CACHE[sid] = {"ts": now, "data": out}
-    return out
+
+def _is_entry(entry: Any) -> bool:
+    """Tiene la forma de lo que guarda cache_set ({"ts": número, "data": dict, ...})"""
+    if not isinstance(entry, dict):
+        return False
+    ts = entry.get("ts")
+    return isinstance(ts, (int, float)) and not isinstance(ts, bool) and isinstance(entry.get("data"), dict)
+
+async def cache_get(sid: str) -> Optional[Dict[str, Any]]:
+    if REDIS is not None:
+        try:
+            raw = await REDIS.get(f"meteo:{sid}")
+        except aioredis.RedisError:
+            raw = None
+        if raw is not None:
+            try:
+                entry = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                entry = None
+            # un valor ilegible cuenta como fallo de cache: se vuelve a descargar y se pisa
+            if _is_entry(entry):
+                CACHE[sid] = entry
+    return CACHE.get(sid)
+
+async def cache_set(sid: str, entry: Dict[str, Any]):
+    CACHE[sid] = entry
+    if REDIS is not None:
+        try:
+            await REDIS.set(f"meteo:{sid}", orjson.dumps(entry), ex=REDIS_KEEP)
+        except aioredis.RedisError:
+            pass
+
+# borra el lock solo si sigue siendo nuestro (puede haber caducado y cogerlo otro worker)
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+async def try_fetch_lock(sid: str) -> Optional[str]:
+    """Lock entre workers con SET NX; devuelve el token, o None si otro worker ya está descargando"""
+    if REDIS is None:
+        return ""
+    token = os.urandom(8).hex()
+    try:
+        ok = await REDIS.set(f"meteo:lock:{sid}", token, nx=True, ex=FETCH_LOCK_TTL)
+    except aioredis.RedisError:
+        return ""
+    return token if ok else None
+
+async def release_fetch_lock(sid: str, token: str):
+    if REDIS is None or not token:
+        return
+    try:
+        await REDIS.eval(_RELEASE_LOCK, 1, f"meteo:lock:{sid}", token)
+    except aioredis.RedisError:
+        pass
+
+async def store_station(station: Dict[str, Any], now: float, cached: Optional[Dict[str, Any]],
+                        content: bytes = None, error: Exception = None,
+                        etag: str = None, last_modified: str = None) -> Dict[str, Any]:
+    """Parsea y guarda en la cache; si falla la descarga sirve el último dato bueno marcado como stale"""
+    if error is not None:
+        if cached and "datos" in cached["data"]:
+            data = dict(cached["data"], stale=True, error=f"fetch_error: {str(error)}")
+            # seguimos validando contra la última versión buena
+            etag, last_modified = cached.get("etag"), cached.get("last_modified")
+        else:
+            data = {"error": f"fetch_error: {str(error)}", "url": station["url"]}
+    else:
+        data = build_station_data(station, content, now)
+    await cache_set(station["id"], {"ts": now, "data": data, "etag": etag, "last_modified": last_modified})
+    return data
+
+# cliente HTTP compartido (se crea al arrancar y se cierra al parar): reutiliza la
+# conexión TLS con meteoxabia.com entre refrescos y, con HTTP/2, las tres estaciones
+# van multiplexadas por la misma conexión
+# httpx pide gzip/deflate y, con el extra brotli instalado, también br (Accept-Encoding
+# por defecto) y descomprime solo; no fijamos la cabecera a mano para no anunciar br
+# si no hay cómo decodificarlo
+CLIENT: httpx.AsyncClient = None
+# un lock por estación para no tener dos descargas de la misma página a la vez
+_LOCKS: Dict[str, asyncio.Lock] = {}
+
+async def fetch_station(station: Dict[str, Any], cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    now = time.time()
+    # GET condicional: si la página no ha cambiado el servidor responde 304 sin cuerpo
+    headers = {}
+    if cached and "datos" in cached["data"]:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        r = await CLIENT.get(station["url"], headers=headers)
+        if r.status_code == 304 and headers:
+            # sin cambios: no hace falta volver a parsear
+            data = {k: v for k, v in cached["data"].items() if k not in ("stale", "error")}
+            data["fetched_at"] = int(now)
+            await cache_set(station["id"], dict(cached, ts=now, data=data))
+            return data
+        r.raise_for_status()
+    except Exception as e:
+        return await store_station(station, now, cached, error=e)
+    return await store_station(station, now, cached, content=r.content,
+                               etag=r.headers.get("etag"), last_modified=r.headers.get("last-modified"))
+
+async def wait_for_station(station: Dict[str, Any]) -> Dict[str, Any]:
+    # otro worker está descargando una estación que aquí no tenemos: esperamos a que la publique
+    for _ in range(FETCH_LOCK_TTL * 4):
+        await asyncio.sleep(0.25)
+        cached = await cache_get(station["id"])
+        if cached:
+            return cached["data"]
+    return await fetch_station(station, None)
+
+async def refresh_station(station: Dict[str, Any], max_age: float = 0) -> Dict[str, Any]:
+    """Descarga la estación, salvo que alguien (este u otro worker) lo haya hecho hace menos de max_age"""
+    sid = station["id"]
+    lock = _LOCKS.setdefault(sid, asyncio.Lock())
+    if lock.locked():
+        # ya hay una descarga en vuelo: esperamos y usamos su resultado
+        async with lock:
+            pass
+        cached = await cache_get(sid)
+        if cached:
+            return cached["data"]
+    async with lock:
+        cached = await cache_get(sid)
+        if cached and time.time() - cached["ts"] < max_age:
+            return cached["data"]
+        token = await try_fetch_lock(sid)
+        if token is None:
+            return cached["data"] if cached else await wait_for_station(station)
+        try:
+            return await fetch_station(station, cached)
+        finally:
+            await release_fetch_lock(sid, token)
+
+async def warm_all():
+    # todas las estaciones a la vez; un fallo en una no para el resto
+    await asyncio.gather(
+        *(refresh_station(s, max_age=CACHE_TTL / 2) for s in list(ESTACIONES.values())),
+        return_exceptions=True,
+    )
+
+_warm_task = None
+_refresh_task = None
+
+async def scrape_station(station: Dict[str, Any]) -> Dict[str, Any]:
+    # el refresco en segundo plano mantiene la cache al día; aquí solo leemos
+    cached = await cache_get(station["id"])
+    if cached:
+        return cached["data"]
+    # cache fría: si hay un warm_all en marcha lo esperamos en vez de lanzar otra descarga
+    if _warm_task and not _warm_task.done():
+        await asyncio.shield(_warm_task)
+        cached = await cache_get(station["id"])
+        if cached:
+            return cached["data"]
+    # estación recién añadida: descarga directa
+    return await refresh_station(station)
+
+async def refresh_loop():
+    global _warm_task
+    while True:
+        _warm_task = asyncio.ensure_future(warm_all())
+        await _warm_task
+        await asyncio.sleep(CACHE_TTL)
+
+async def start_refresh():
+    global CLIENT, REDIS, _refresh_task
+    CLIENT = httpx.AsyncClient(
+        timeout=10,
+        # como requests.get: seguir las redirecciones de meteoxabia.com
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+    )
+    if REDIS_URL:
+        REDIS = aioredis.Redis.from_url(
+            REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+        )
+    _refresh_task = asyncio.create_task(refresh_loop())
+
+async def stop_refresh():
+    if _refresh_task:
+        _refresh_task.cancel()
+        # que termine de cancelarse antes de cerrar el cliente que puede estar usando
+        with suppress(asyncio.CancelledError):
+            await _refresh_task
+    if CLIENT:
+        await CLIENT.aclose()
+    if REDIS is not None:
+        await REDIS.aclose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_refresh()
+    try:
+        yield
+    finally:
+        await stop_refresh()
+
+app = FastAPI(title="MeteoXabia API", version="1.0", lifespan=lifespan)
 
 # -------------------------
 # ENDPOINTS
-@app.get("/api/estaciones")
-def api_estaciones():
-    lst = [{"id": v["id"], "nombre": v["nombre"]} for v in ESTACIONES.values()]
-    return JSONResponse(content=lst)
-
-@app.get("/api/estacion/{station_id}/completo")
-def api_estacion_completo(station_id: str):
+async def _get_estacion_data(station_id: str) -> Dict[str, Any]:
     s = ESTACIONES.get(station_id)
     if not s:
         raise HTTPException(status_code=404, detail="Estación no encontrada")
-    data = scrape_station(s)
-    return JSONResponse(content=data)
+    return await scrape_station(s)
 
-@app.get("/api/estacion/{station_id}/ahora")
-def api_estacion_ahora(station_id: str):
-    obj = api_estacion_completo.__wrapped__(station_id) if hasattr(api_estacion_completo, "__wrapped__") else api_estacion_completo(station_id)
-    # object's "datos" contains us
+@app.get("/api/estaciones")
+async def api_estaciones() -> List[Dict[str, Any]]:
+    lst = [{"id": v["id"], "nombre": v["nombre"]} for v in ESTACIONES.values()]
+    return lst
+
+# vistas de cada endpoint a partir de los datos de la estación
+def view_ahora(obj: Dict[str, Any]) -> Dict[str, Any]:
     datos = obj.get("datos", {})
-    ahora = {
+    return {
         "temperature": datos.get("temperature"),
         "humidity": datos.get("humidity"),
         "wind_kmh": datos.get("wind_speed_kmh"),
         "rain_mm": datos.get("rain_mm"),
         "fetched_at": obj.get("fetched_at"),
     }
-    return JSONResponse(content=ahora)
 
-@app.get("/api/estacion/{station_id}/dia")
-def api_estacion_dia(station_id: str):
-    s = ESTACIONES.get(station_id)
-    if not s:
-        raise HTTPException(status_code=404, detail="Estación no encontrada")
-    data = scrape_station(s)
+def view_dia(data: Dict[str, Any]) -> Dict[str, Any]:
     datos = data.get("datos", {})
-    dia = {
+    return {
         "day_max_temp": datos.get("day_temp_max"),
         "day_min_temp": datos.get("day_temp_min"),
         "day_max_wind": datos.get("day_wind_max"),
         "rain_today": datos.get("rain_today") or datos.get("rain_mm"),
         "fetched_at": data.get("fetched_at")
     }
-    return JSONResponse(content=dia)
 
-@app.get("/api/estacion/{station_id}/mes")
-def api_estacion_mes(station_id: str):
-    s = ESTACIONES.get(station_id)
-    if not s:
-        raise HTTPException(status_code=404, detail="Estación no encontrada")
-    data = scrape_station(s)
+def view_mes(data: Dict[str, Any]) -> Dict[str, Any]:
     datos = data.get("datos", {})
-    mes = {
+    return {
         "month_rain_mm": datos.get("month_rain_mm"),
         "month_max_temp": datos.get("month_temp_max"),
         "month_min_temp": datos.get("month_temp_min"),
         "fetched_at": data.get("fetched_at")
     }
-    return JSONResponse(content=mes)
 
-@app.get("/api/estacion/{station_id}/anio")
-def api_estacion_anio(station_id: str):
-    s = ESTACIONES.get(station_id)
-    if not s:
-        raise HTTPException(status_code=404, detail="Estación no encontrada")
-    data = scrape_station(s)
+def view_anio(data: Dict[str, Any]) -> Dict[str, Any]:
     datos = data.get("datos", {})
-    anio = {
+    return {
         "year_rain_mm": datos.get("year_rain_mm"),
         "year_max_temp": datos.get("year_temp_max"),
         "year_min_temp": datos.get("year_temp_min"),
         "fetched_at": data.get("fetched_at")
     }
-    return JSONResponse(content=anio)
+
+# JSON ya serializado de cada vista: (estación, vista) -> (ts de la entrada, bytes).
+# Mientras no llegue un dato nuevo las peticiones repetidas no vuelven a construir
+# ni a serializar nada
+_VIEWS: Dict[Tuple[str, str], Tuple[float, bytes]] = {}
+
+async def _view_response(station_id: str, view: str, build: Callable[[Dict[str, Any]], Any]) -> Response:
+    data = await _get_estacion_data(station_id)
+    # solo se reutiliza si data es la entrada de la cache (no la de un fetch directo)
+    entry = CACHE.get(station_id)
+    ts = entry["ts"] if entry and entry["data"] is data else None
+    hit = _VIEWS.get((station_id, view))
+    if hit and ts is not None and hit[0] == ts:
+        body = hit[1]
+    else:
+        body = orjson.dumps(build(data))
+        if ts is not None:
+            _VIEWS[(station_id, view)] = (ts, body)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/api/estacion/{station_id}/completo")
+async def api_estacion_completo(station_id: str) -> Response:
+    return await _view_response(station_id, "completo", lambda data: data)
+
+@app.get("/api/estacion/{station_id}/ahora")
+async def api_estacion_ahora(station_id: str) -> Response:
+    return await _view_response(station_id, "ahora", view_ahora)
+
+@app.get("/api/estacion/{station_id}/dia")
+async def api_estacion_dia(station_id: str) -> Response:
+    return await _view_response(station_id, "dia", view_dia)
+
+@app.get("/api/estacion/{station_id}/mes")
+async def api_estacion_mes(station_id: str) -> Response:
+    return await _view_response(station_id, "mes", view_mes)
+
+@app.get("/api/estacion/{station_id}/anio")
+async def api_estacion_anio(station_id: str) -> Response:
+    return await _view_response(station_id, "anio", view_anio)
 
 # -------------------------
 # util: añadir nueva estación (runtime)
 @app.post("/api/estacion/add")
-def api_add_station(item: Dict[str, Any]):
-    # item must have id, nombre, url, tipo
+async def api_add_station(item: Dict[str, Any]) -> Dict[str, Any]:
+    # item must have id, nombre, url, tipo (y opcionalmente selectors)
     if not all(k in item for k in ("id", "nombre", "url")):
         raise HTTPException(status_code=400, detail="Faltan campos id/nombre/url")
+    selectors = item.get("selectors")
+    if selectors is not None:
+        # opcional: {"campo": "selector CSS"}; se compilan ya para rechazar los inválidos
+        try:
+            for css in selectors.values():
+                compile_selector(css)
+        except (AttributeError, TypeError, SelectorError):
+            raise HTTPException(status_code=400, detail="selectors debe ser {campo: selector CSS}")
     sid = item["id"]
     ESTACIONES[sid] = {
         "id": sid,
@@ -321,4 +638,26 @@ def api_add_station(item: Dict[str, Any]):
         "url": item["url"],
         "tipo": item.get("tipo", "avamet")
     }
-    return JSONResponse(content={"ok": True, "estacion": ESTACIONES[sid]})
+    if selectors:
+        ESTACIONES[sid]["selectors"] = selectors
+    return {"ok": True, "estacion": ESTACIONES[sid]}
+
+# -------------------------
+# arranque: python main.py, equivale a
+#   uvicorn main:app --host 0.0.0.0 --port $PORT --workers $WEB_CONCURRENCY --loop auto --http httptools
+# (loop auto usa uvloop donde lo hay; en Windows no existe)
+# sin REDIS_URL cada worker tiene su propio CACHE y descarga por su cuenta, así que por
+# defecto un solo worker para no multiplicar las descargas (Render free: no abusar); con
+# Redis, uno por CPU. En cualquier caso una estación añadida con /api/estacion/add solo
+# existe en el worker que atendió la petición
+if __name__ == "__main__":
+    import uvicorn
+    default_workers = (os.cpu_count() or 1) if REDIS_URL else 1
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8000)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", default_workers)),
+        loop="auto",
+        http="httptools",
+    )
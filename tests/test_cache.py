@@ -0,0 +1,102 @@
+import asyncio
+import importlib.util
+import os
+
+import fakeredis
+import httpx
+import pytest
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+PAGE = """<html><body><table>
+<tr><td>Temperatura:</td><td>21,4 °C</td></tr>
+<tr><td>Humedad:</td><td>65 %</td></tr>
+<tr><td>Lluvia hoy</td><td>1,2 mm</td></tr>
+</table></body></html>""".encode()
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def load(name, handler, redis=None):
+    """Una copia de main con su propio CACHE, como un worker más"""
+    spec = importlib.util.spec_from_file_location(name, MAIN)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    mod.CLIENT = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    mod.REDIS = redis
+    return mod
+
+
+async def test_cold_fetch_shared_between_workers():
+    server = fakeredis.FakeServer()
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url)
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, content=PAGE)
+
+    w1 = load("w1", handler, fakeredis.aioredis.FakeRedis(server=server))
+    w2 = load("w2", handler, fakeredis.aioredis.FakeRedis(server=server))
+    a, b = await asyncio.gather(
+        w1.scrape_station(w1.ESTACIONES["port"]),
+        w2.scrape_station(w2.ESTACIONES["port"]),
+    )
+    # solo un worker descarga, el otro espera a que publique en Redis
+    assert len(calls) == 1
+    assert a == b
+    assert a["datos"]["temperature"] == 21.4
+
+
+@pytest.mark.parametrize("raw", [b"garbage", b"1", b'{"x": 1}', b'{"ts": 1, "data": 5}', b'{"ts": "1", "data": {}}'])
+async def test_corrupt_redis_entry_is_a_miss(raw):
+    redis = fakeredis.aioredis.FakeRedis()
+    await redis.set("meteo:port", raw)
+    m = load("corrupt", lambda request: httpx.Response(200, content=PAGE), redis)
+    data = await m.scrape_station(m.ESTACIONES["port"])
+    assert data["datos"]["temperature"] == 21.4
+    # la nueva descarga pisa el valor ilegible
+    assert m._is_entry(m.orjson.loads(await redis.get("meteo:port")))
+
+
+async def test_5xx_serves_stale_and_304_clears_it():
+    responses = [
+        httpx.Response(200, content=PAGE, headers={"ETag": '"v1"'}),
+        httpx.Response(503),
+        httpx.Response(304),
+    ]
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("if-none-match"))
+        return responses[len(seen) - 1]
+
+    m = load("cond", handler)
+    st = m.ESTACIONES["port"]
+    fresh = await m.refresh_station(st)
+    stale = await m.refresh_station(st)
+    assert stale["stale"] is True
+    assert "503" in stale["error"]
+    assert stale["datos"] == fresh["datos"]
+    again = await m.refresh_station(st)
+    # tras el fallo se sigue validando contra la última versión buena
+    assert seen == [None, '"v1"', '"v1"']
+    assert "stale" not in again and "error" not in again
+    assert again["datos"] == fresh["datos"]
+    assert m.CACHE["port"]["etag"] == '"v1"'
+
+
+async def test_view_bytes_cached_until_ts_changes():
+    m = load("views", lambda request: httpx.Response(500))
+    m.CACHE["port"] = {"ts": 1.0, "data": {"id": "port", "datos": {"temperature": 1.0}, "fetched_at": 1}}
+    r1 = await m.api_estacion_ahora("port")
+    r2 = await m.api_estacion_ahora("port")
+    assert r1.body is r2.body
+    m.CACHE["port"] = {"ts": 2.0, "data": {"id": "port", "datos": {"temperature": 2.0}, "fetched_at": 2}}
+    r3 = await m.api_estacion_ahora("port")
+    assert m.orjson.loads(r3.body)["temperature"] == 2.0
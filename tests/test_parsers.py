@@ -0,0 +1,71 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+WX9_HUMIDEX = b"""<html><body>
+<span>Humidity 65 %</span><span>Humidex: 31</span><span>Temperature 18.0 &deg;C</span>
+</body></html>"""
+
+
+def test_wx9_humidex_is_not_humidity():
+    # "Humidex" es la sensación térmica de Weather Display, no la humedad
+    datos = main.parse_wx9(main.parse_html(WX9_HUMIDEX))
+    assert datos["humidity"] == 65.0
+    assert datos["temperature"] == 18.0
+
+
+def test_wx9_humidity_label():
+    datos = main.parse_wx9(main.parse_html(b"<html><body><span>Humedad relativa: 72</span></body></html>"))
+    assert datos["humidity"] == 72.0
+
+
+def test_partial_selectors_keep_generic_fields():
+    # un selector suelto no debe dejar fuera lo que encuentra el parser genérico
+    station = {"id": "x", "nombre": "x", "url": "http://x", "tipo": "avamet", "selectors": {"temperature": "span"}}
+    page = b"<html><body><span>18.5</span><p>Humedad: 60</p></body></html>"
+    datos = main.build_station_data(station, page, 0)["datos"]
+    assert datos["temperature"] == 18.5
+    assert datos["humidity"] == 60.0
+
+
+WX9_AJAX = b"""<html><body><table>
+<tr><td>Temperature</td><td><span id="ajaxtemp">19.8 &deg;C</span></td></tr>
+<tr><td>Humidity</td><td><span id="ajaxhumidity">72</span> %</td></tr>
+<tr><td>Wind</td><td><span id="ajaxwind">NE 10 mph</span></td></tr>
+<tr><td>Rain</td><td><span id="ajaxrain">0,4 mm</span></td></tr>
+<tr><td>Max Temp</td><td><span id="ajaxtempmax">23.5 &deg;C</span></td></tr>
+<tr><td>Min Temp</td><td><span id="ajaxtempmin">12.1 &deg;C</span></td></tr>
+{extra}
+</table></body></html>"""
+
+
+def test_wx9_selectors():
+    page = WX9_AJAX.replace(b"{extra}", b'<tr><td>Max Wind</td><td><span id="ajaxwindmaxgust">30.2 km/h</span></td></tr>')
+    datos = main.build_station_data(main.ESTACIONES["lluca"], page, 0)["datos"]
+    assert datos == {
+        "temperature": 19.8,
+        "humidity": 72.0,
+        "wind_speed_kmh": 16.09,  # 10 mph
+        "rain_mm": 0.4,
+        "day_temp_max": 23.5,
+        "day_temp_min": 12.1,
+        "day_wind_max": 30.2,
+    }
+
+
+def test_wx9_selectors_override_generic():
+    # sin #ajaxwindmaxgust corre el parser genérico; lo leído por selector manda
+    page = WX9_AJAX.replace(b"{extra}", b"<tr><td>Humidity: 40 %</td><td>Max Wind 25 km/h</td></tr>")
+    datos = main.build_station_data(main.ESTACIONES["lluca"], page, 0)["datos"]
+    assert main.parse_wx9(main.parse_html(page))["humidity"] == 40.0
+    assert datos["humidity"] == 72.0
+    assert datos["wind_speed_kmh"] == 16.09
+    assert datos["day_wind_max"] == 25.0
+
+
+def test_selectors_are_html_case_insensitive():
+    tree = main.parse_html(b"<html><body><SPAN>18.5</SPAN></body></html>")
+    assert main.parse_specialized(tree, {"temperature": "SPAN"}) == {"temperature": 18.5}